@@ -2,14 +2,21 @@
 # ────────────────────────────────────────────────────────────────────────────────
 # streamlit_app.py — aplicativo Streamlit
 # ────────────────────────────────────────────────────────────────────────────────
+from concurrent.futures import TimeoutError as FutureTimeoutError
 from typing import Dict
 
 import streamlit as st
 from utils import (
     build_form_and_get_responses,
-    save_to_sheets,
+    submit_save_to_sheets,
+    build_sheet_row,
+    sheet_row_digest,
     generate_pdf,
+    normalize_responses,
     sync_sample_number,
+    sync_yes_no_responses,
+    fragment,
+    SHEETS_WRITE_TIMEOUT,
 )
 
 st.set_page_config(
@@ -22,54 +29,107 @@ st.title("Oliveira Energia — Registro de coleta de amostra de óleo")
 if "pdf_bytes" not in st.session_state:
     st.session_state["pdf_bytes"] = None
 
-responses: Dict[str, object] = build_form_and_get_responses()
 
-if st.button("✅ Enviar & Gerar PDF"):
-    sample_no = str(responses.get("n.º da Amostra", "") or "").strip()
-    if not sample_no:
-        st.error("⚠️ Preencha o campo *n.º da Amostra* (obrigatório).")
-    else:
-        responses["n.º da Amostra"] = sample_no
-        sync_sample_number(sample_no)
+@fragment
+def _submit_region(responses: Dict[str, object]) -> None:
+    """Envio + download: reexecuta só esta região, sem redesenhar o formulário."""
+    if st.button("✅ Enviar & Gerar PDF"):
+        # Os radios Sim/Não rodam em fragmentos próprios: relê os valores atuais
+        sync_yes_no_responses(responses)
+        sample_no = str(responses.get("n.º da Amostra", "") or "").strip()
+        if not sample_no:
+            st.error("⚠️ Preencha o campo *n.º da Amostra* (obrigatório).")
+        else:
+            responses["n.º da Amostra"] = sample_no
+            sync_sample_number(sample_no)
+
+            last_loaded = st.session_state.get("sample_last_loaded_number", "") or ""
+            existing_row = st.session_state.get("sample_row_index")
+            existing_extras = dict(st.session_state.get("sample_existing_extras", {}))
+            if sample_no != last_loaded:
+                existing_row = None
+                existing_extras = {}
+                st.session_state["sample_row_index"] = None
+                st.session_state["sample_existing_extras"] = {}
 
-        last_loaded = st.session_state.get("sample_last_loaded_number", "") or ""
-        existing_row = st.session_state.get("sample_row_index")
-        existing_extras = dict(st.session_state.get("sample_existing_extras", {}))
-        if sample_no != last_loaded:
-            existing_row = None
-            existing_extras = {}
-            st.session_state["sample_row_index"] = None
-            st.session_state["sample_existing_extras"] = {}
+            # Respostas convertidas para texto uma só vez (planilha e PDF); a linha
+            # montada serve ao hash e à gravação
+            normalized = normalize_responses(responses)
+            sheet_row = build_sheet_row(normalized, existing_extras)
+            # Reenvio sem alterações desde a última gravação: não chama o Sheets
+            row_digest = sheet_row_digest(sheet_row)
+            unchanged = (
+                existing_row is not None
+                and st.session_state.get("last_saved_row") == (existing_row, row_digest)
+            )
 
-        with st.spinner("Salvando no Google Sheets..."):
-            try:
-                row_idx = save_to_sheets(
-                    responses,
-                    existing_row=existing_row,
-                    existing_extras=existing_extras,
-                )
-                st.session_state["sample_row_index"] = row_idx
-                st.session_state["sample_last_loaded_number"] = sample_no
-                st.session_state["sample_existing_extras"] = existing_extras
-                st.session_state["sample_lookup_status"] = "loaded"
-                st.session_state["sample_lookup_message"] = (
-                    f"Amostra {sample_no} sincronizada na linha {row_idx}."
-                )
-                if existing_row is not None:
-                    st.success(f"♻️ Registro atualizado na linha {row_idx} (A..AH).")
+            with st.status("Salvando no Google Sheets e gerando PDF...") as status:
+                # A gravação (I/O) roda em segundo plano enquanto o PDF (CPU) é gerado
+                save_future = None
+                if not unchanged:
+                    save_future = submit_save_to_sheets(
+                        normalized,
+                        existing_row=existing_row,
+                        existing_extras=existing_extras,
+                        prepared_row=sheet_row,
+                    )
+                # A linha contém todas as respostas do PDF: mesmo hash, mesmo PDF
+                if st.session_state.get("pdf_digest") == row_digest and st.session_state["pdf_bytes"]:
+                    pdf_bytes = st.session_state["pdf_bytes"]
                 else:
-                    st.success(f"📊 Dados gravados na linha {row_idx} (A..AH).")
-            except Exception as exc:
-                st.error(str(exc))
-                st.stop()
-        with st.spinner("Gerando PDF..."):
-            st.session_state["pdf_bytes"] = generate_pdf(responses)
-        st.info("✅ PDF gerado — utilize o botão abaixo para baixar.")
+                    pdf_bytes = generate_pdf(normalized)
+                if save_future is None:
+                    row_idx = existing_row
+                else:
+                    try:
+                        row_idx = save_future.result(timeout=SHEETS_WRITE_TIMEOUT)
+                    except FutureTimeoutError:
+                        status.update(label="Falha ao salvar no Google Sheets.", state="error")
+                        # Ainda na fila: cancela, e a thread de gravação o descarta
+                        if save_future.cancel():
+                            st.error(
+                                f"❌ O Google Sheets não respondeu em {SHEETS_WRITE_TIMEOUT} s. "
+                                "Nada foi gravado — tente enviar novamente."
+                            )
+                        else:
+                            st.error(
+                                f"❌ O Google Sheets não confirmou a gravação em {SHEETS_WRITE_TIMEOUT} s. "
+                                "Confira a planilha antes de enviar novamente."
+                            )
+                        st.stop()
+                    except Exception as exc:
+                        status.update(label="Falha ao salvar no Google Sheets.", state="error")
+                        st.error(str(exc))
+                        st.stop()
+                status.update(label="Dados salvos e PDF gerado.", state="complete")
+
+            st.session_state["last_saved_row"] = (row_idx, row_digest)
+            st.session_state["sample_row_index"] = row_idx
+            st.session_state["sample_last_loaded_number"] = sample_no
+            st.session_state["sample_existing_extras"] = existing_extras
+            st.session_state["sample_lookup_status"] = "loaded"
+            st.session_state["sample_lookup_message"] = (
+                f"Amostra {sample_no} sincronizada na linha {row_idx}."
+            )
+            if unchanged:
+                st.info(f"ℹ️ Sem alterações desde o último envio (linha {row_idx}).")
+            elif existing_row is not None:
+                st.success(f"♻️ Registro atualizado na linha {row_idx} (A..AH).")
+            else:
+                st.success(f"📊 Dados gravados na linha {row_idx} (A..AH).")
+            st.session_state["pdf_bytes"] = pdf_bytes
+            st.session_state["pdf_digest"] = row_digest
+            st.info("✅ PDF gerado — utilize o botão abaixo para baixar.")
+
+    if st.session_state["pdf_bytes"]:
+        st.download_button(
+            label="⬇️ Baixar PDF",
+            data=st.session_state["pdf_bytes"],
+            file_name=f"amostra_{responses.get('n.º da Amostra', 'sem_numero')}.pdf",
+            mime="application/pdf",
+        )
+
+
+responses: Dict[str, object] = build_form_and_get_responses()
 
-if st.session_state["pdf_bytes"]:
-    st.download_button(
-        label="⬇️ Baixar PDF",
-        data=st.session_state["pdf_bytes"],
-        file_name=f"amostra_{responses.get('n.º da Amostra', 'sem_numero')}.pdf",
-        mime="application/pdf",
-    )
+_submit_region(responses)
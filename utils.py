@@ -4,41 +4,63 @@
 # ────────────────────────────────────────────────────────────────────────────────
 from __future__ import annotations
 
-import io
 import os
 import re
 import json
+import hashlib
+import functools
+import queue
+import threading
+from concurrent.futures import Future
 from math import ceil
 from datetime import datetime
-from typing import Dict, List, Tuple, Any, Optional
+from typing import TYPE_CHECKING, Dict, List, Tuple, Any, Optional
 
-import qrcode
-from fpdf import FPDF
-from googleapiclient.discovery import build
-from googleapiclient.errors import HttpError
-from google.auth.transport.requests import Request
-from google.oauth2.credentials import Credentials
-
-from barcode import Code128
-from barcode.writer import ImageWriter
+# Bibliotecas pesadas (Google API, fpdf, qrcode, barcode) são importadas dentro das
+# funções que as usam: o Streamlit reimporta o módulo a cada sessão nova.
+if TYPE_CHECKING:
+    from fpdf import FPDF
+    from google.auth.credentials import Credentials
 
 try:
     import streamlit as st
 except ModuleNotFoundError:
     st = None  # permite importar utils.py sem Streamlit
 
+
+def _cache_resource(func):
+    """Memoiza ``func`` por processo (``st.cache_resource`` ou ``lru_cache`` sem Streamlit)."""
+    if st is not None:
+        return st.cache_resource(show_spinner=False)(func)
+    return functools.lru_cache(maxsize=1)(func)
+
+
+def _cache_data(ttl: int):
+    """``st.cache_data`` com expiração; sem Streamlit a função roda sem cache."""
+    def decorator(func):
+        if st is not None:
+            return st.cache_data(ttl=ttl, show_spinner=False)(func)
+        return func
+    return decorator
+
 # ░░░ Config Google Sheets ░░░
 SCOPES = ["https://www.googleapis.com/auth/spreadsheets"]
 
 SPREADSHEET_ID = "1VLDQUCO3Aw4ClAvhjkUsnBxG44BTjz-MjHK04OqPxYM"
 SHEET_NAME = "Geral"
 
+# Novas tentativas (backoff exponencial do googleapiclient) em 429/5xx e falhas de
+# conexão. Só para chamadas idempotentes: repetir um append poderia duplicar a linha.
+SHEETS_NUM_RETRIES = 3
+# Tempo máximo (s) que o envio do formulário espera a confirmação da gravação
+SHEETS_WRITE_TIMEOUT = 60
+
 # ░░░ Rótulo e coluna de destino do novo campo O.S. ░░░
 OS_FORM_LABEL = "Ordem de Serviço (O.S.)"
-OS_TARGET_COL = "AH"  # coluna onde gravaremos a O.S. após o append A..AG
+OS_TARGET_COL = "AH"  # coluna da O.S., gravada junto com A..AG no mesmo append
 
-# ░░░ Cabeçalhos EXATOS da planilha (A..AG), sem a coluna OS (AH) ░░░
-SHEET_HEADERS_EXCL_OS: List[str] = [
+# ░░░ Cabeçalhos EXATOS da planilha (A..AH), na ordem das colunas ░░░
+SHEET_HEADERS: List[str] = [
     "Estado de Origem",
     "Cliente",
     "Data da coleta",
@@ -71,7 +93,8 @@ SHEET_HEADERS_EXCL_OS: List[str] = [
     "Pessoa de contato",
     "Telefone",
     "Status",        # AF — vazio nesta etapa
-    "Data Status"    # AG — vazio nesta etapa
+    "Data Status",   # AG — vazio nesta etapa
+    OS_FORM_LABEL,   # AH
 ]
 
 # ░░░ Mapeia cada cabeçalho -> label do formulário (quando diferir) ░░░
@@ -107,57 +130,177 @@ SHEET_HEADER_TO_FORM: Dict[str, str] = {
     "Detalhes das anormalidades (caso Haja)": "Detalhes das anormalidades (caso Haja):",
     "Pessoa de contato": "Pessoa de contato:",
     "Telefone": "Telefone:",
+    OS_FORM_LABEL: OS_FORM_LABEL,
     # "Status" e "Data Status" são vazios nesta etapa
 }
 
+# ░░░ Planos de escrita/leitura, resolvidos uma vez na importação ░░░
+# Escrita: (cabeçalho, label) na ordem de SHEET_HEADERS;
+# label None = coluna preservada via ``existing_extras`` (Status/Data Status)
+_WRITE_PLAN: Tuple[Tuple[str, Optional[str]], ...] = tuple(
+    (hdr, None if hdr in ("Status", "Data Status") else SHEET_HEADER_TO_FORM[hdr])
+    for hdr in SHEET_HEADERS
+)
+# Leitura: (label do formulário, cabeçalho na planilha)
+_READ_PLAN: Tuple[Tuple[str, str], ...] = tuple(
+    (form_label, hdr) for hdr, form_label in SHEET_HEADER_TO_FORM.items()
+)
+
 # ░░░ Autenticação Google ░░░
+_TOKEN_PATH = "token.json"
+_last_token_json: Optional[str] = None
+_token_lock = threading.Lock()
+
+def _read_secret(name: str) -> Any:
+    """Valor do Streamlit Secrets ou, na falta dele, da variável de ambiente."""
+    value = None
+    if st:
+        try:
+            value = st.secrets.get(name)
+        except FileNotFoundError:  # sem secrets.toml: segue para o ambiente
+            value = None
+    return value or os.getenv(name)
+
+def _parse_json_secret(name: str, value: Any) -> Dict[str, Any]:
+    # Nos secrets o valor pode vir como tabela TOML (já um mapeamento) ou como texto JSON
+    if hasattr(value, "keys"):
+        return dict(value)
+    try:
+        return json.loads(value)
+    except Exception as exc:
+        raise RuntimeError(f"{name} inválido (JSON).") from exc
+
+@functools.lru_cache(maxsize=1)
+def _client_config() -> Dict[str, Any]:
+    """Client secret do Streamlit Secrets ou da variável de ambiente, lido e parseado uma vez."""
+    client_secret = _read_secret("GOOGLE_CLIENT_SECRET")
+    if not client_secret:
+        raise RuntimeError(
+            "Credenciais Google ausentes. Defina GOOGLE_SERVICE_ACCOUNT ou "
+            "GOOGLE_CLIENT_SECRET nos secrets/ambiente."
+        )
+    return _parse_json_secret("GOOGLE_CLIENT_SECRET", client_secret)
+
+def _in_streamlit_runtime() -> bool:
+    runtime = getattr(st, "runtime", None)
+    exists = getattr(runtime, "exists", None)
+    return bool(callable(exists) and exists())
+
 def _authorize_google_sheets() -> Credentials:
-    # Preferencialmente usa token.json quando executado localmente
-    token_path = "token.json"
+    from google.auth.transport.requests import Request
+    from google.oauth2.credentials import Credentials
+
+    # Conta de serviço, quando configurada: JWT assinado em memória, renovado pela
+    # própria biblioteca — sem token.json e sem consentimento interativo
+    service_account_info = _read_secret("GOOGLE_SERVICE_ACCOUNT")
+    if service_account_info:
+        from google.oauth2 import service_account
+
+        return service_account.Credentials.from_service_account_info(
+            _parse_json_secret("GOOGLE_SERVICE_ACCOUNT", service_account_info),
+            scopes=SCOPES,
+        )
+
+    # Senão, token OAuth do usuário em token.json
     creds = None
-    if os.path.exists(token_path):
-        creds = Credentials.from_authorized_user_file(token_path, SCOPES)
+    if os.path.exists(_TOKEN_PATH):
+        creds = Credentials.from_authorized_user_file(_TOKEN_PATH, SCOPES)
 
     if not creds or not creds.valid:
         if creds and creds.expired and creds.refresh_token:
             creds.refresh(Request())
         else:
-            # Busca client secret do Streamlit Secrets ou variável de ambiente
-            client_secret_json = None
-            if st:
-                client_secret_json = st.secrets.get("GOOGLE_CLIENT_SECRET")
-            if not client_secret_json:
-                client_secret_json = os.getenv("GOOGLE_CLIENT_SECRET")
-            if not client_secret_json:
-                raise RuntimeError("Credenciais Google ausentes. Defina GOOGLE_CLIENT_SECRET nos secrets/ambiente.")
-            # Usa InstalledAppFlow apenas se você rodar localmente e quiser abrir consent
+            # O consentimento interativo travaria o servidor à espera do navegador
+            if _in_streamlit_runtime():
+                raise RuntimeError(
+                    "token.json ausente ou expirado sem refresh token. Configure "
+                    "GOOGLE_SERVICE_ACCOUNT nos secrets ou gere token.json localmente."
+                )
+            # Uso local (fora do Streamlit): abre o consentimento no navegador
             from google_auth_oauthlib.flow import InstalledAppFlow
-            try:
-                client_config = json.loads(client_secret_json)
-            except Exception as exc:
-                raise RuntimeError("GOOGLE_CLIENT_SECRET inválido (JSON).") from exc
-            flow = InstalledAppFlow.from_client_config(client_config, SCOPES)
-            # Nota: em ambientes sem navegador, use run_console()
-            if st:
-                creds = flow.run_console()
-            else:
-                creds = flow.run_console()
-        # Persiste token.json quando possível
+            flow = InstalledAppFlow.from_client_config(_client_config(), SCOPES)
+            creds = flow.run_local_server(port=0)
+        _persist_token(creds)
+    return creds
+
+def _persist_token(creds: Credentials) -> None:
+    """Persiste token.json quando possível — e só quando o conteúdo mudou."""
+    global _last_token_json
+    token_json = creds.to_json()
+    with _token_lock:
+        if token_json == _last_token_json:
+            return
         try:
-            with open(token_path, "w", encoding="utf-8") as fp:
-                fp.write(creds.to_json())
+            with open(_TOKEN_PATH, "w", encoding="utf-8") as fp:
+                fp.write(token_json)
+            _last_token_json = token_json
         except Exception:
             pass
-    return creds
 
+@_cache_resource
+def _get_credentials() -> Credentials:
+    # Depois de carregadas, o access token expirado é renovado pelo AuthorizedHttp
+    # de cada thread antes da requisição (ver ``_thread_http``)
+    return _authorize_google_sheets()
+
+# Conexões autenticadas emprestadas a cada requisição: httplib2.Http não é
+# thread-safe, e as threads do script mudam a cada rerun — um pool (em vez de uma
+# conexão por thread) reaproveita o TLS entre reruns e sessões
+_http_pool: "queue.SimpleQueue[Any]" = queue.SimpleQueue()
+
+def _checkout_http():
+    try:
+        return _http_pool.get_nowait()
+    except queue.Empty:
+        import google_auth_httplib2
+        from googleapiclient.http import build_http
+
+        # build_http(): mesmo Http que o build() criaria — timeout de socket (60 s)
+        # e 308 fora dos redirecionamentos
+        return google_auth_httplib2.AuthorizedHttp(_get_credentials(), http=build_http())
+
+def _build_request(http, *args, **kwargs):
+    from googleapiclient.http import HttpRequest
+
+    # Ignora o transporte do serviço compartilhado: execute() pega uma conexão do
+    # pool, usa-a com exclusividade e a devolve ao terminar
+    request = HttpRequest(None, *args, **kwargs)
+    execute = request.execute
+
+    def pooled_execute(*exec_args, **exec_kwargs):
+        request.http = _checkout_http()
+        try:
+            return execute(*exec_args, **exec_kwargs)
+        finally:
+            _http_pool.put(request.http)
+            request.http = None
+
+    request.execute = pooled_execute
+    return request
+
+@_cache_resource
 def _get_sheets_service():
-    return build("sheets", "v4", credentials=_authorize_google_sheets(), cache_discovery=False)
+    from googleapiclient.discovery import build
+
+    # Reaproveitado entre reruns: evita reler token.json e reconstruir o cliente a
+    # cada busca/gravação. ``static_discovery`` usa o documento de discovery
+    # embarcado na biblioteca (nenhum download na criação). O serviço é
+    # compartilhado entre sessões e a thread de gravação; as conexões HTTPS vêm do
+    # pool de ``_build_request``, uma por requisição em andamento.
+    return build(
+        "sheets",
+        "v4",
+        credentials=_get_credentials(),
+        requestBuilder=_build_request,
+        static_discovery=True,
+        cache_discovery=False,
+    )
 
 # ░░░ Estrutura do formulário (labels do formulário) ░░░
-FORM_SECTIONS: List[Tuple[str, List[Tuple[str, Any]]]] = [
+FORM_SECTIONS: Tuple[Tuple[str, Tuple[Tuple[str, Any], ...]], ...] = (
     (
         "Geral",
-        [
+        (
             ("Estado de Origem", "AM"),
             ("Cliente", "Pie - Oliveira Energia"),
             ("Data da coleta", datetime.today().strftime("%d/%m/%Y")),
@@ -166,11 +309,11 @@ FORM_SECTIONS: List[Tuple[str, List[Tuple[str, Any]]]] = [
             ("Responsável Pela Coleta:", ""),
             ("n.º da Amostra", ""),           # obrigatório
             (OS_FORM_LABEL, ""),              # NOVO campo — lado a lado no PDF
-        ],
+        ),
     ),
     (
         "Equipamento",
-        [
+        (
             ("n.º de série:", ""),
             ("Frota:", ""),
             ("Horímetro do Óleo:", ""),
@@ -180,11 +323,11 @@ FORM_SECTIONS: List[Tuple[str, List[Tuple[str, Any]]]] = [
             ("Fabricante do Equipamento:", "Scania"),
             ("Modelo:", "DC13"),
             ("Horímetro do Motor", ""),
-        ],
+        ),
     ),
     (
         "Óleo",
-        [
+        (
             ("Houve complemento de óleo?", False),
             ("Se sim, quantos litros?", ""),
             ("Amostra coletada:", "Motor"),
@@ -198,49 +341,43 @@ FORM_SECTIONS: List[Tuple[str, List[Tuple[str, Any]]]] = [
             ("A temperatura de operação está normal?", False),
             ("O desempenho do sistema está normal?", False),
             ("Detalhes das anormalidades (caso Haja):", ""),
-        ],
+        ),
     ),
     (
         "Contato",
-        [
+        (
             ("Pessoa de contato:", "Francisco Sampaio"),
             ("Telefone:", "(92) 99437-6579"),
-        ],
+        ),
     ),
-]
+)
 
-BOOL_LABELS = {
-    label
-    for _, questions in FORM_SECTIONS
+# ░░░ Campos achatados: (seção, label, default, é_booleano), na ordem do formulário ░░░
+_FIELDS: Tuple[Tuple[str, str, Any, bool], ...] = tuple(
+    (section, label, default, isinstance(default, bool))
+    for section, questions in FORM_SECTIONS
     for label, default in questions
-    if isinstance(default, bool)
-}
-
-
-def _build_base_defaults() -> Dict[str, Any]:
-    defaults: Dict[str, Any] = {}
-    for _, questions in FORM_SECTIONS:
-        for label, default in questions:
-            defaults[label] = default
-    return defaults
+)
+_FORM_LABELS: Tuple[str, ...] = tuple(label for _, label, _, _ in _FIELDS)
 
-
-BASE_FORM_DEFAULTS = _build_base_defaults()
+BOOL_LABELS = frozenset(label for _, label, _, is_bool in _FIELDS if is_bool)
+BASE_FORM_DEFAULTS: Dict[str, Any] = {label: default for _, label, default, _ in _FIELDS}
 
 # ░░░ Helpers de estado do formulário ░░░
 def _apply_form_values(values: Dict[str, Any]) -> None:
     if st is None:
         return
-    form_values = st.session_state.setdefault("form_values", {})
+    state = st.session_state
+    form_values = state.setdefault("form_values", {})
     for label, value in values.items():
         form_values[label] = value
         if isinstance(value, bool):
-            key_yes = f"{label}_yes"
-            key_no = f"{label}_no"
-            st.session_state[key_yes] = bool(value)
-            st.session_state[key_no] = not bool(value)
+            widget_value = "Sim" if value else "Não"
         else:
-            st.session_state[label] = "" if value is None else str(value)
+            widget_value = "" if value is None else str(value)
+        # Só grava no session_state o que de fato mudou no widget (chave = label)
+        if state.get(label) != widget_value:
+            state[label] = widget_value
 
 
 def _queue_form_updates(values: Dict[str, Any]) -> None:
@@ -268,13 +405,28 @@ def _reset_form_defaults(keep_sample: Optional[str] = None) -> None:
         defaults["n.º da Amostra"] = keep_sample
     if st is None:
         return
+    if st.session_state.get("form_values") == defaults:
+        return  # formulário já está nos padrões: nada a enfileirar
     st.session_state["form_values"] = defaults
     _queue_form_updates(defaults)
 
 
+def _migrate_checkbox_state() -> None:
+    """Converte as chaves ``<label>_yes``/``<label>_no`` (dois checkboxes) para o radio."""
+    if st.session_state.get("_yes_no_migrated"):
+        return
+    for label in BOOL_LABELS:
+        legacy_yes = st.session_state.pop(f"{label}_yes", None)
+        legacy_no = st.session_state.pop(f"{label}_no", None)
+        if legacy_yes or legacy_no:
+            st.session_state.setdefault(label, "Sim" if legacy_yes else "Não")
+    st.session_state["_yes_no_migrated"] = True
+
+
 def _ensure_form_state() -> None:
     if st is None:
         return
+    _migrate_checkbox_state()
     if "form_values" not in st.session_state:
         st.session_state["form_values"] = BASE_FORM_DEFAULTS.copy()
         _apply_form_values(st.session_state["form_values"])
@@ -296,82 +448,133 @@ def _column_letter_to_index(col: str) -> int:
         raise ValueError("Coluna vazia")
     idx = 0
     for ch in col:
-        if not ch.isalpha():
+        digit = ord(ch) - 64  # "A" -> 1 … "Z" -> 26
+        if not 1 <= digit <= 26:
             raise ValueError(f"Coluna inválida: {col}")
-        idx = idx * 26 + (ord(ch) - ord("A") + 1)
+        idx = idx * 26 + digit
     return idx - 1
 
 
+def _column_index_to_letter(idx: int) -> str:
+    if idx < 0:
+        raise ValueError(f"Índice de coluna inválido: {idx}")
+    letters = ""
+    idx += 1
+    while idx:
+        idx, rem = divmod(idx - 1, 26)
+        letters = chr(ord("A") + rem) + letters
+    return letters
+
+
+# Coluna esperada de "n.º da Amostra" (G); conferida contra o cabeçalho real a cada busca
+_SAMPLE_COL_IDX = SHEET_HEADERS.index("n.º da Amostra")
+_SAMPLE_COL = _column_index_to_letter(_SAMPLE_COL_IDX)
+# Coluna da O.S. quando o cabeçalho não a traz (AH)
+_OS_TARGET_COL_IDX = _column_letter_to_index(OS_TARGET_COL)
+
+
+_TRUE_SET = frozenset({"sim", "s", "true", "1", "yes"})
+_FALSE_SET = frozenset({"não", "nao", "n", "false", "0", "no"})
+
+
 def _coerce_sheet_value(label: str, value: Any) -> Any:
-    if label in BOOL_LABELS:
-        text = "" if value is None else str(value).strip().lower()
-        if text in {"sim", "s", "true", "1", "yes"}:
-            return True
-        if text in {"não", "nao", "n", "false", "0", "no"}:
-            return False
-        base_default = BASE_FORM_DEFAULTS.get(label)
-        return bool(base_default) if isinstance(base_default, bool) else False
-    return "" if value is None else str(value)
+    if label not in BOOL_LABELS:
+        return "" if value is None else str(value)
+    text = "" if value is None else str(value).strip().lower()
+    if text in _TRUE_SET:
+        return True
+    if text in _FALSE_SET:
+        return False
+    base_default = BASE_FORM_DEFAULTS.get(label)
+    return bool(base_default) if isinstance(base_default, bool) else False
 
 
-def _fetch_sample_from_sheets(sample_number: str) -> Optional[Tuple[int, Dict[str, Any], int, Dict[str, str]]]:
+def _fetch_sample_from_sheets_uncached(sample_number: str) -> Optional[Tuple[int, Dict[str, Any], int, Dict[str, str]]]:
+    from googleapiclient.errors import HttpError
+
     service = _get_sheets_service()
+    values_api = service.spreadsheets().values()
     try:
-        result = (
-            service.spreadsheets()
-            .values()
-            .get(
+        # 1ª ida: só o cabeçalho e a coluna das amostras (não a planilha inteira)
+        sample_col = _SAMPLE_COL
+        result = values_api.batchGet(
+            spreadsheetId=SPREADSHEET_ID,
+            ranges=[f"{SHEET_NAME}!1:1", f"{SHEET_NAME}!{sample_col}2:{sample_col}"],
+        ).execute(num_retries=SHEETS_NUM_RETRIES)
+        header_range, sample_range = (result.get("valueRanges", []) + [{}, {}])[:2]
+
+        header = (header_range.get("values") or [[]])[0]
+        if not header:
+            return None
+        header_map = {name: idx for idx, name in enumerate(header)}
+        sample_col_idx = header_map.get("n.º da Amostra")
+        if sample_col_idx is None:
+            raise RuntimeError("Cabeçalho 'n.º da Amostra' não encontrado na planilha.")
+        if sample_col_idx != _SAMPLE_COL_IDX:
+            # Colunas reordenadas na planilha: relê a coluna indicada pelo cabeçalho
+            sample_col = _column_index_to_letter(sample_col_idx)
+            sample_range = values_api.get(
                 spreadsheetId=SPREADSHEET_ID,
-                range=f"{SHEET_NAME}!A:AH",
-            )
-            .execute()
-        )
+                range=f"{SHEET_NAME}!{sample_col}2:{sample_col}",
+            ).execute(num_retries=SHEETS_NUM_RETRIES)
+
+        # Varre de baixo para cima: a 1ª ocorrência é a mais recente (a que vale);
+        # as demais só incrementam o contador de duplicatas
+        sample_rows = sample_range.get("values", [])
+        row_idx: Optional[int] = None
+        match_count = 0
+        for idx in range(len(sample_rows) - 1, -1, -1):
+            row = sample_rows[idx]
+            if row and str(row[0]).strip() == sample_number:
+                if row_idx is None:
+                    row_idx = idx + 2  # +1 (base 1) +1 (cabeçalho)
+                match_count += 1
+        if row_idx is None:
+            return None
+
+        # 2ª ida: apenas a linha vencedora
+        row_result = values_api.get(
+            spreadsheetId=SPREADSHEET_ID,
+            range=f"{SHEET_NAME}!A{row_idx}:AH{row_idx}",
+        ).execute(num_retries=SHEETS_NUM_RETRIES)
     except HttpError as exc:
         raise RuntimeError(f"Erro ao consultar planilha: {exc}") from exc
 
-    rows = result.get("values", [])
-    if not rows:
-        return None
-
-    header = rows[0]
-    header_map = {name: idx for idx, name in enumerate(header)}
-    sample_col_idx = header_map.get("n.º da Amostra")
-    if sample_col_idx is None:
-        raise RuntimeError("Cabeçalho 'n.º da Amostra' não encontrado na planilha.")
-
-    os_col_idx = header_map.get(OS_FORM_LABEL)
-    if os_col_idx is None:
-        os_col_idx = _column_letter_to_index(OS_TARGET_COL)
+    row_values = (row_result.get("values") or [[]])[0]
 
-    matches: List[Tuple[int, List[str]]] = []
-    for idx, row in enumerate(rows[1:], start=2):
-        cell_value = row[sample_col_idx] if sample_col_idx < len(row) else ""
-        if str(cell_value).strip() == sample_number:
-            matches.append((idx, row))
+    os_col_idx = header_map.get(OS_FORM_LABEL, _OS_TARGET_COL_IDX)
 
-    if not matches:
-        return None
-
-    row_idx, row_values = matches[-1]
     form_data: Dict[str, Any] = {}
     extras: Dict[str, str] = {}
-    for sheet_header, form_label in SHEET_HEADER_TO_FORM.items():
+    for form_label, sheet_header in _READ_PLAN:
         col_idx = header_map.get(sheet_header)
         if col_idx is None:
             continue
         cell_value = row_values[col_idx] if col_idx < len(row_values) else ""
         form_data[form_label] = _coerce_sheet_value(form_label, cell_value)
 
-    if os_col_idx is not None:
-        cell_value = row_values[os_col_idx] if os_col_idx < len(row_values) else ""
-        form_data[OS_FORM_LABEL] = "" if cell_value is None else str(cell_value)
+    cell_value = row_values[os_col_idx] if os_col_idx < len(row_values) else ""
+    form_data[OS_FORM_LABEL] = "" if cell_value is None else str(cell_value)
 
     for header_name in ("Status", "Data Status"):
         idx = header_map.get(header_name)
         if idx is not None and idx < len(row_values):
             extras[header_name] = "" if row_values[idx] is None else str(row_values[idx])
 
-    return row_idx, form_data, len(matches), extras
+    return row_idx, form_data, match_count, extras
+
+
+@_cache_data(ttl=30)
+def _fetch_sample_from_sheets(sample_number: str) -> Optional[Tuple[int, Dict[str, Any], int, Dict[str, str]]]:
+    """Busca com cache curto: voltar a uma amostra já consultada não chama o Sheets."""
+    return _fetch_sample_from_sheets_uncached(sample_number)
+
+
+def _clear_sample_cache() -> None:
+    """Descarta buscas em cache após uma gravação, para não exibir dados antigos."""
+    clear = getattr(_fetch_sample_from_sheets, "clear", None)
+    if clear is not None:
+        clear()
 
 
 def _handle_sample_change() -> None:
@@ -379,6 +582,13 @@ def _handle_sample_change() -> None:
         return
     raw_value = st.session_state.get("n.º da Amostra", "")
     sample_value = str(raw_value).strip()
+    # Mesmo número já carregado (ex.: só espaços mudaram): não consulta o Sheets de novo
+    if (
+        sample_value
+        and sample_value == st.session_state.get("sample_last_loaded_number")
+        and st.session_state.get("sample_lookup_status") in ("loaded", "new")
+    ):
+        return
     st.session_state["sample_lookup_warning"] = None
 
     if sample_value:
@@ -438,6 +648,14 @@ def _trigger_rerun() -> None:
             return
 
 
+def fragment(func):
+    """``st.fragment`` (ou ``st.experimental_fragment``); sem suporte, roda como função comum."""
+    if st is None:
+        return func
+    decorator = getattr(st, "fragment", None) or getattr(st, "experimental_fragment", None)
+    return decorator(func) if callable(decorator) else func
+
+
 # ░░░ Helpers UI ░░░
 def _render_sample_feedback() -> None:
     if st is None:
@@ -460,38 +678,69 @@ def _render_sample_feedback() -> None:
         st.warning(warning)
 
 
-def _two_checkboxes(label: str, default: bool | None = None) -> bool:
+_YES_NO_OPTIONS = ("Sim", "Não")
+
+
+def _yes_no(label: str, default: bool | None = None) -> bool:
+    """Pergunta Sim/Não como um único ``st.radio`` horizontal, com o próprio label como chave."""
     if st is None:
         raise RuntimeError("Streamlit não instalado – UI indisponível.")
-    st.markdown(f"**{label}**")
-    key_yes = f"{label}_yes"
-    key_no  = f"{label}_no"
-    if key_yes not in st.session_state and key_no not in st.session_state:
-        if default is True:
-            st.session_state[key_yes] = True
-            st.session_state[key_no] = False
-        elif default is False:
-            st.session_state[key_yes] = False
-            st.session_state[key_no] = True
-        else:
-            st.session_state[key_yes] = False
-            st.session_state[key_no] = False
+    if label not in st.session_state:
+        st.session_state[label] = {True: "Sim", False: "Não"}.get(default)
+    return st.radio(label, _YES_NO_OPTIONS, key=label, horizontal=True) == "Sim"
 
-    col_yes, col_no = st.columns(2)
 
-    def _sync_yes() -> None:
-        if st.session_state[key_yes]:
-            st.session_state[key_no] = False
+@fragment
+def _yes_no_field(label: str, default: bool | None) -> None:
+    """
+    Sim/Não dentro de um fragmento: o clique reexecuta só este radio, não o formulário
+    inteiro. O retorno de um fragmento não chega a quem o chamou, então o valor fica
+    no ``st.session_state`` (chave = label) e é lido de lá por ``sync_yes_no_responses``.
+    """
+    st.session_state["form_values"][label] = _yes_no(label, default=default)
 
-    def _sync_no() -> None:
-        if st.session_state[key_no]:
-            st.session_state[key_yes] = False
 
-    with col_yes:
-        st.checkbox("Sim", key=key_yes, on_change=_sync_yes)
-    with col_no:
-        st.checkbox("Não", key=key_no, on_change=_sync_no)
-    return bool(st.session_state[key_yes])
+def sync_yes_no_responses(responses: Dict[str, Any]) -> Dict[str, Any]:
+    """
+    Atualiza em ``responses`` as respostas Sim/Não a partir do ``st.session_state``.
+
+    Cada radio roda no próprio fragmento; quando só ele (ou só o envio) é reexecutado,
+    o ``responses`` montado no último rerun completo fica desatualizado — chame esta
+    função antes de usar as respostas num fragmento.
+    """
+    state = st.session_state
+    for label in BOOL_LABELS:
+        responses[label] = state.get(label) == "Sim"
+    return responses
+
+
+def _render_sample_and_os(form_values: Dict[str, Any], responses: Dict[str, Any]) -> None:
+    """n.º da Amostra (com busca automática) e O.S. lado a lado, seguidos do feedback."""
+    sample_label = "n.º da Amostra"
+    col_sample, col_os = st.columns(2)
+
+    with col_sample:
+        sample_default = form_values.get(sample_label, "")
+        sample_value = st.text_input(
+            sample_label,
+            value="" if sample_default is None else str(sample_default),
+            key=sample_label,
+            on_change=_handle_sample_change,
+        )
+        sample_value = st.session_state.get(sample_label, sample_value)
+    responses[sample_label] = sample_value
+    form_values[sample_label] = sample_value
+
+    with col_os:
+        os_default = form_values.get(OS_FORM_LABEL, "")
+        os_value = st.text_input(
+            OS_FORM_LABEL,
+            value="" if os_default is None else str(os_default),
+        )
+    responses[OS_FORM_LABEL] = os_value
+    form_values[OS_FORM_LABEL] = os_value
+
+    _render_sample_feedback()
 
 
 def build_form_and_get_responses() -> Dict[str, Any]:
@@ -501,155 +750,254 @@ def build_form_and_get_responses() -> Dict[str, Any]:
 
     _ensure_form_state()
     form_values = st.session_state["form_values"]
+    text_input = st.text_input
 
     st.header("Formulário de Coleta de Amostras de Óleo 🛢️")
-    responses: Dict[str, Any] = {}
-
-    for section, questions in FORM_SECTIONS:
-        st.subheader(section)
-
-        if section == "Geral":
-            sample_label = "n.º da Amostra"
-            col_sample, col_os = st.columns(2)
-
-            with col_sample:
-                sample_default = form_values.get(sample_label, "")
-                sample_value = st.text_input(
-                    sample_label,
-                    value="" if sample_default is None else str(sample_default),
-                    key=sample_label,
-                    on_change=_handle_sample_change,
-                )
-                sample_value = st.session_state.get(sample_label, sample_value)
-            responses[sample_label] = sample_value
-            form_values[sample_label] = sample_value
-
-            with col_os:
-                os_default = form_values.get(OS_FORM_LABEL, "")
-                os_value = st.text_input(
-                    OS_FORM_LABEL,
-                    value="" if os_default is None else str(os_default),
-                )
-            responses[OS_FORM_LABEL] = os_value
-            form_values[OS_FORM_LABEL] = os_value
-
-            _render_sample_feedback()
-
-            for label, default in questions:
-                if label in {sample_label, OS_FORM_LABEL}:
-                    continue
-                effective_default = form_values.get(label, default)
-                if isinstance(default, bool):
-                    if isinstance(effective_default, bool):
-                        default_bool = effective_default
-                    else:
-                        default_bool = default
-                    value = _two_checkboxes(label, default=default_bool)
-                else:
-                    value = st.text_input(
-                        label,
-                        value="" if effective_default is None else str(effective_default),
-                    )
-                responses[label] = value
-                form_values[label] = value
+    responses: Dict[str, Any] = dict.fromkeys(_FORM_LABELS, "")
+
+    current_section = None
+    for section, label, default, is_bool in _FIELDS:
+        if section != current_section:
+            current_section = section
+            st.subheader(section)
+            if section == "Geral":
+                _render_sample_and_os(form_values, responses)
+        if label in ("n.º da Amostra", OS_FORM_LABEL):
+            continue  # já desenhados lado a lado no topo de "Geral"
+
+        effective_default = form_values.get(label, default)
+        if is_bool:
+            if not isinstance(effective_default, bool):
+                effective_default = default
+            _yes_no_field(label, effective_default)
             continue
+        value = text_input(
+            label,
+            value="" if effective_default is None else str(effective_default),
+        )
+        responses[label] = value
+        form_values[label] = value
 
-        for label, default in questions:
-            effective_default = form_values.get(label, default)
-            if isinstance(default, bool):
-                if isinstance(effective_default, bool):
-                    default_bool = effective_default
-                else:
-                    default_bool = default
-                value = _two_checkboxes(label, default=default_bool)
-            else:
-                value = st.text_input(
-                    label,
-                    value="" if effective_default is None else str(effective_default),
-                )
-            responses[label] = value
-            form_values[label] = value
-
-    return responses
+    return sync_yes_no_responses(responses)
 
 # ░░░ Persistência no Google Sheets ░░░
+_FMT_SPECIAL: Dict[Any, str] = {True: "Sim", False: "Não", None: ""}
+
 def _fmt(v: Any) -> str:
-    if v is True:
-        return "Sim"
-    if v is False:
-        return "Não"
-    return "" if v is None else str(v)
+    if isinstance(v, str):
+        return v
+    return _FMT_SPECIAL[v] if v is None or isinstance(v, bool) else str(v)
+
+def normalize_responses(responses: Dict[str, Any]) -> Dict[str, str]:
+    """
+    Respostas já como texto ("Sim"/"Não" nos booleanos). Feito uma vez por envio, a
+    mesma versão alimenta a linha da planilha e o PDF.
+    """
+    return {label: _fmt(responses.get(label, "")) for label in _FORM_LABELS}
+
+# Linha gravada no retorno do append: "Geral!A12:AH12" ou "Geral!A12" -> 12
+_UPDATED_RANGE_RE = re.compile(r"!\D*(\d+)(?::|$)")
+
+def build_sheet_row(
+    responses: Dict[str, Any],
+    existing_extras: Optional[Dict[str, str]] = None,
+) -> List[str]:
+    """
+    Monta a linha A..AH na ordem de ``SHEET_HEADERS``. Montada uma vez por envio,
+    serve ao hash de reenvio e à gravação (``prepared_row``).
+    """
+    extras = existing_extras or {}
+    return [
+        extras.get(hdr, "") if label is None else _fmt(responses.get(label, ""))
+        for hdr, label in _WRITE_PLAN
+    ]
+
+def sheet_row_digest(row: List[str]) -> str:
+    """Hash da linha montada por ``build_sheet_row`` — permite pular reenvios idênticos."""
+    payload = json.dumps(row, ensure_ascii=False).encode("utf-8")
+    return hashlib.blake2b(payload, digest_size=16).hexdigest()
 
 def save_to_sheets(
     responses: Dict[str, Any],
     existing_row: Optional[int] = None,
     existing_extras: Optional[Dict[str, str]] = None,
+    prepared_row: Optional[List[str]] = None,
 ) -> int:
     """
     Persiste os dados no Google Sheets.
 
-    * Quando ``existing_row`` é ``None``: faz APPEND de A..AG e atualiza AH com a O.S.
+    * Quando ``existing_row`` é ``None``: faz um único APPEND de A..AH (O.S. incluída).
     * Quando ``existing_row`` é informado: atualiza A..AH na linha indicada, preservando
       colunas não presentes no formulário (Status/Data Status) através de ``existing_extras``.
+    * ``prepared_row``: linha já montada por ``build_sheet_row`` (evita formatá-la de novo).
     Retorna o índice (1-based) da linha gravada/atualizada.
     """
 
-    extras = existing_extras or {}
+    row_out = prepared_row if prepared_row is not None else build_sheet_row(responses, existing_extras)
+    if existing_row is not None:
+        row_idx_int = int(existing_row)
+        _update_rows([(row_idx_int, row_out)])
+        return row_idx_int
+    return _append_rows([row_out])[0]
 
-    row_out: List[str] = []
-    for hdr in SHEET_HEADERS_EXCL_OS:
-        if hdr in ("Status", "Data Status"):
-            row_out.append(extras.get(hdr, ""))
-            continue
-        form_label = SHEET_HEADER_TO_FORM.get(hdr)
-        val = responses.get(form_label, "") if form_label else ""
-        row_out.append(_fmt(val))
 
-    os_value = _fmt(responses.get(OS_FORM_LABEL, ""))
+def _update_rows(
+    updates: List[Tuple[int, List[str]]], num_retries: int = SHEETS_NUM_RETRIES
+) -> None:
+    """Regrava linhas A..AH existentes numa única chamada ``values.batchUpdate``."""
+    from googleapiclient.errors import HttpError
 
     try:
-        service = _get_sheets_service()
+        _get_sheets_service().spreadsheets().values().batchUpdate(
+            spreadsheetId=SPREADSHEET_ID,
+            body={
+                "valueInputOption": "RAW",
+                "data": [
+                    {"range": f"{SHEET_NAME}!A{row_idx}:AH{row_idx}", "values": [row]}
+                    for row_idx, row in updates
+                ],
+            },
+        ).execute(num_retries=num_retries)
+    except HttpError as exc:
+        # Sem st.error aqui: a gravação pode rodar fora da thread do script
+        raise RuntimeError(f"❌ Erro ao gravar no Google Sheets → {exc}") from exc
+    _clear_sample_cache()
 
-        if existing_row is not None:
-            row_idx_int = int(existing_row)
-            row_full = list(row_out)
-            row_full.append(os_value)
-            service.spreadsheets().values().update(
-                spreadsheetId=SPREADSHEET_ID,
-                range=f"{SHEET_NAME}!A{row_idx_int}:AH{row_idx_int}",
-                valueInputOption="RAW",
-                body={"values": [row_full]},
-            ).execute()
-            return row_idx_int
-
-        body = {"values": [row_out]}
-        append_result = service.spreadsheets().values().append(
+
+def _append_rows(rows: List[List[str]]) -> List[int]:
+    """Acrescenta as linhas num único APPEND e devolve o índice (1-based) de cada uma."""
+    from googleapiclient.errors import HttpError
+
+    try:
+        append_result = _get_sheets_service().spreadsheets().values().append(
             spreadsheetId=SPREADSHEET_ID,
             range=f"{SHEET_NAME}!A1",
             valueInputOption="RAW",
-            insertDataOption="INSERT_ROWS",
-            body=body,
+            # Sem insertDataOption (padrão OVERWRITE): grava nas linhas vazias após a
+            # tabela, sem o Sheets inserir linhas novas na grade
+            body={"values": rows},
         ).execute()
+    except HttpError as exc:
+        raise RuntimeError(f"❌ Erro ao gravar no Google Sheets → {exc}") from exc
+    _clear_sample_cache()
+
+    updated_range = (append_result or {}).get("updates", {}).get("updatedRange", "")
+    m = _UPDATED_RANGE_RE.search(updated_range)
+    if not m:
+        raise RuntimeError(f"Não foi possível detectar a linha inserida: {updated_range}")
+    first_row = int(m.group(1))
+    return [first_row + offset for offset in range(len(rows))]
+
+
+# ░░░ Fila de gravação: uma thread por processo grava em lote os envios de todas as sessões ░░░
+_WRITE_BATCH_MAX = 100  # envios por lote (uma chamada de batchUpdate + um append)
+
+_WriteItem = Tuple[List[str], Optional[int], "Future[int]"]
+
+# Fora do cache do Streamlit: "Clear cache" não deve criar uma segunda fila/thread
+_write_queue: "Optional[queue.SimpleQueue[_WriteItem]]" = None
+_write_queue_lock = threading.Lock()
+
+
+def _get_write_queue() -> "queue.SimpleQueue[_WriteItem]":
+    global _write_queue
+    with _write_queue_lock:
+        if _write_queue is None:
+            write_queue: "queue.SimpleQueue[_WriteItem]" = queue.SimpleQueue()
+            threading.Thread(
+                target=_write_worker,
+                args=(write_queue,),
+                name="sheets-writer",
+                daemon=True,
+            ).start()
+            _write_queue = write_queue
+        return _write_queue
+
+
+def _write_worker(write_queue: "queue.SimpleQueue[_WriteItem]") -> None:
+    while True:
+        batch = [write_queue.get()]
+        # Sem janela de espera: o lote junta o que chegou enquanto o anterior gravava,
+        # então um envio isolado não fica mais lento
+        while len(batch) < _WRITE_BATCH_MAX:
+            try:
+                batch.append(write_queue.get_nowait())
+            except queue.Empty:
+                break
+        _flush_write_batch(batch)
 
-        updated_range = (append_result or {}).get("updates", {}).get("updatedRange", "")
-        m = re.search(r"!.*?(\d+):", updated_range) or re.search(r"!.*?(\d+)$", updated_range)
-        if not m:
-            raise RuntimeError(f"Não foi possível detectar a linha inserida: {updated_range}")
-        row_idx_int = int(m.group(1))
 
-        service.spreadsheets().values().update(
-            spreadsheetId=SPREADSHEET_ID,
-            range=f"{SHEET_NAME}!{OS_TARGET_COL}{row_idx_int}",
-            valueInputOption="RAW",
-            body={"values": [[os_value]]},
-        ).execute()
+def _rejected_by_sheets(exc: Exception) -> bool:
+    """A API recusou a requisição (4xx, exceto 429): nada foi gravado."""
+    status = getattr(getattr(exc.__cause__, "resp", None), "status", None)
+    return status is not None and 400 <= int(status) < 500 and int(status) != 429
 
-        return row_idx_int
 
-    except HttpError as exc:
-        if st:
-            st.error("❌ Erro ao gravar no Google Sheets.")
-        raise RuntimeError(f"Erro ao gravar → {exc}") from exc
+def _flush_write_batch(batch: List[_WriteItem]) -> None:
+    """
+    Grava um lote. Se a API recusar a chamada do grupo (update/append), cada envio é
+    regravado sozinho e sem novas tentativas: um item inválido (ex.: linha fora da
+    grade) não derruba os das outras sessões. Falhas de servidor/rede (5xx, timeout)
+    vão direto para os ``Future`` do grupo, sem prender a thread com reenvios.
+    """
+    batch = [item for item in batch if item[2].set_running_or_notify_cancel()]
+    updates = [item for item in batch if item[1] is not None]
+    appends = [item for item in batch if item[1] is None]
+
+    if updates:
+        try:
+            _update_rows([(row_idx, row) for row, row_idx, _ in updates])
+        except Exception as exc:  # noqa: BLE001
+            if len(updates) == 1 or not _rejected_by_sheets(exc):
+                for _, _, future in updates:
+                    future.set_exception(exc)
+            else:
+                for row, row_idx, future in updates:
+                    _settle(future, lambda: _update_rows([(row_idx, row)], num_retries=0) or row_idx)
+        else:
+            for _, row_idx, future in updates:
+                future.set_result(row_idx)
+
+    if appends:
+        try:
+            row_indices = _append_rows([row for row, _, _ in appends])
+        except Exception as exc:  # noqa: BLE001
+            # Append não é idempotente: só reenvia item a item se o lote foi recusado
+            if len(appends) == 1 or not _rejected_by_sheets(exc):
+                for _, _, future in appends:
+                    future.set_exception(exc)
+            else:
+                for row, _, future in appends:
+                    _settle(future, lambda: _append_rows([row])[0])
+        else:
+            for (_, _, future), row_idx in zip(appends, row_indices):
+                future.set_result(row_idx)
+
+
+def _settle(future: "Future[int]", write) -> None:
+    try:
+        future.set_result(write())
+    except Exception as exc:  # noqa: BLE001
+        future.set_exception(exc)
+
+
+def submit_save_to_sheets(
+    responses: Dict[str, Any],
+    existing_row: Optional[int] = None,
+    existing_extras: Optional[Dict[str, str]] = None,
+    prepared_row: Optional[List[str]] = None,
+) -> "Future[int]":
+    """
+    Enfileira a gravação e devolve o ``Future`` com a linha gravada (mesmo retorno de
+    ``save_to_sheets``).
+
+    Permite gerar o PDF enquanto a requisição ao Google Sheets está em andamento; envios
+    simultâneos de várias sessões saem juntos num só ``batchUpdate``/``append``.
+    """
+    row = list(prepared_row) if prepared_row is not None else build_sheet_row(responses, existing_extras)
+    future: "Future[int]" = Future()
+    _get_write_queue().put((row, None if existing_row is None else int(existing_row), future))
+    return future
 
 # ░░░ PDF ░░░
 _REPL = {
@@ -660,37 +1008,171 @@ _REPL = {
     "\n": " ",
     "\r": " ",
 }
+_TRANS = str.maketrans(_REPL)  # uma única passada em C no lugar dos replace()
+
+@functools.lru_cache(maxsize=4096, typed=True)
 def _safe(txt: object) -> str:
+    # As fontes core do fpdf2 (Helvetica) aceitam latin-1, o que cobre o português;
+    # só o que estiver fora dele vira "?". Texto ASCII dispensa o encode/decode.
     if txt is None:
         return ""
     if not isinstance(txt, str):
         txt = str(txt)
-    for bad, good in _REPL.items():
-        txt = txt.replace(bad, good)
+    txt = txt.translate(_TRANS)
+    if txt.isascii():
+        return txt
     return txt.encode("latin-1", "replace").decode("latin-1")
 
+# Labels e títulos de seção são fixos: deixa o cache já aquecido para o PDF
+for _section, _questions in FORM_SECTIONS:
+    _safe(_section)
+    for _label, _ in _questions:
+        _safe(_label)
+del _section, _questions, _label
+
+# Versão 1 (21×21, nível L) comporta até 25 caracteres alfanuméricos — cobre os
+# números de amostra; é a mesma que o best_fit escolheria
+_QR_VERSION = 1
+
+@functools.lru_cache(maxsize=256)
+def _qr_blocks(sample_no: str) -> Tuple[int, Tuple[Tuple[int, int, int, int], ...]]:
+    """
+    Módulos escuros do QR da amostra: ``(lado_em_módulos, ((x, y, largura, altura), ...))``.
+
+    Cada trecho escuro de uma linha vira um retângulo, e trechos iguais em linhas
+    seguidas são fundidos num só: menos ``rect`` no PDF e sem emendas entre linhas.
+    """
+    import qrcode
+    from qrcode.exceptions import DataOverflowError
+
+    # Instância nova por chamada: o PDF pode ser gerado por sessões em threads distintas
+    qr = qrcode.QRCode(
+        version=_QR_VERSION,
+        error_correction=qrcode.constants.ERROR_CORRECT_L,
+        border=0,  # a zona de silêncio é aplicada no desenho
+    )
+    qr.add_data(sample_no)
+    try:
+        qr.make(fit=False)  # versão fixa: dispensa a busca do best_fit
+    except DataOverflowError:
+        qr.make(fit=True)   # número longo demais para a versão fixa
+
+    blocks: List[Tuple[int, int, int, int]] = []
+    open_blocks: Dict[Tuple[int, int], Tuple[int, int]] = {}  # (x, largura) -> (y, altura)
+    for y, row in enumerate(qr.modules):
+        current: Dict[Tuple[int, int], Tuple[int, int]] = {}
+        x, n = 0, len(row)
+        while x < n:
+            if not row[x]:
+                x += 1
+                continue
+            start = x
+            while x < n and row[x]:
+                x += 1
+            span = (start, x - start)
+            top, height = open_blocks.pop(span, (y, 0))
+            current[span] = (top, height + 1)
+        blocks.extend((bx, top, bw, bh) for (bx, bw), (top, bh) in open_blocks.items())
+        open_blocks = current
+    blocks.extend((bx, top, bw, bh) for (bx, bw), (top, bh) in open_blocks.items())
+    return len(qr.modules), tuple(blocks)
+
+def _draw_qr(pdf: FPDF, sample_no: str, x: float, y: float, w: float) -> None:
+    """Desenha o QR como retângulos vetoriais (sem PIL), num quadrado de lado ``w``."""
+    n_modules, blocks = _qr_blocks(sample_no)
+    quiet = 2  # zona de silêncio, em módulos
+    module = w / (n_modules + 2 * quiet)
+    x0 = x + quiet * module
+    y0 = y + quiet * module
+    pdf.set_fill_color(0)
+    for bx, by, bw, bh in blocks:
+        pdf.rect(x0 + bx * module, y0 + by * module, bw * module, bh * module, style="F")
+
+@functools.lru_cache(maxsize=256)
+def _barcode_bars(sample_no: str) -> Tuple[int, Tuple[Tuple[int, int], ...]]:
+    """
+    Módulos do Code128 da amostra: ``(total_de_módulos, ((início, largura), ...))``.
+
+    Barras vizinhas já vêm agrupadas, de modo que cada tupla vira um único ``rect``.
+    """
+    from barcode import Code128
+
+    modules = Code128(sample_no).build()[0]
+    bars = []
+    start = None
+    for pos, bit in enumerate(modules):
+        if bit == "1":
+            if start is None:
+                start = pos
+        elif start is not None:
+            bars.append((start, pos - start))
+            start = None
+    if start is not None:
+        bars.append((start, len(modules) - start))
+    return len(modules), tuple(bars)
+
+def _draw_barcode(pdf: FPDF, sample_no: str, x: float, y: float, w: float, h: float) -> None:
+    """Desenha o Code128 como retângulos vetoriais (sem PIL), com o número logo abaixo."""
+    n_modules, bars = _barcode_bars(sample_no)
+    quiet = 10  # zona de silêncio mínima do Code128, em módulos
+    module_w = w / (n_modules + 2 * quiet)
+    x_bars = x + quiet * module_w
+    pdf.set_fill_color(0)
+    for start, width in bars:
+        pdf.rect(x_bars + start * module_w, y, width * module_w, h, style="F")
+    pdf.set_font("Helvetica", size=7)
+    pdf.set_xy(x, y + h + 0.5)
+    pdf.cell(w, 3, _safe(sample_no), align="C")
+
+_PDF_ROW_H = 4.5          # altura de cada linha de perguntas
+_PDF_SECTION_H = 7        # altura da faixa com o título da seção
+_PDF_LABEL_RATIO = 0.655  # fração de cada coluna ocupada pelo label
+
+@functools.lru_cache(maxsize=4)
+def _pdf_body_layout(x0: float, inner_width: float) -> Tuple[Tuple[Any, ...], ...]:
+    """
+    Geometria fixa do corpo do PDF (duas perguntas por linha), calculada uma só vez.
+
+    Coordenadas ``y`` são relativas ao início do corpo. Cada seção vira
+    ``(título, y_título, y_grade, altura_grade, linhas, labels, valores)``, com
+    ``linhas`` = divisórias ``(x1, y1, x2, y2)``, ``labels`` = ``(x, y, texto)`` e
+    ``valores`` = ``(x, y, label_do_formulário)``.
+    """
+    group_width = inner_width / 2
+    label_w = group_width * _PDF_LABEL_RATIO
+    x_right = x0 + inner_width
+    col_xs = (x0 + label_w, x0 + group_width, x0 + group_width + label_w)
+
+    layout = []
+    y = 0.0
+    for section, qs in FORM_SECTIONS:
+        y_top = y + _PDF_SECTION_H
+        n_rows = ceil(len(qs) / 2)
+        grid_h = n_rows * _PDF_ROW_H
+        lines = [(x, y_top, x, y_top + grid_h) for x in col_xs]
+        lines += [
+            (x0, y_top + r * _PDF_ROW_H, x_right, y_top + r * _PDF_ROW_H)
+            for r in range(1, n_rows)
+        ]
+        labels = []
+        values = []
+        for idx, (label, _) in enumerate(qs):
+            x_group = x0 + (idx % 2) * group_width
+            y_row = y_top + (idx // 2) * _PDF_ROW_H
+            labels.append((x_group, y_row, _safe(label)))
+            values.append((x_group + label_w, y_row, label))
+        layout.append((_safe(section), y, y_top, grid_h, tuple(lines), tuple(labels), tuple(values)))
+        y = y_top + grid_h + 1  # respiro de 1 mm entre seções
+    return tuple(layout)
+
 def generate_pdf(responses: Dict[str, Any]) -> bytes:
     """
     Gera um PDF A4 (retrato). O campo O.S. está logo após 'n.º da Amostra' no bloco 'Geral',
     então os dois caem lado a lado (duas colunas) sem criar linha extra.
     """
-    sample_no = str(responses.get("n.º da Amostra", "SEM_NUMERO")).strip() or "SEM_NUMERO"
+    from fpdf import FPDF
 
-    # QR em memória
-    qr_img = qrcode.make(sample_no)
-    buf_qr = io.BytesIO()
-    qr_img.save(buf_qr, format="PNG")
-    buf_qr.seek(0)
-
-    # Código de barras em memória
-    buf_bar = io.BytesIO()
-    barcode = Code128(sample_no, writer=ImageWriter())
-    barcode.write(buf_bar, options={
-        "module_width": 0.3,
-        "module_height": 15,
-        "font_size": 8,
-    })
-    buf_bar.seek(0)
+    sample_no = str(responses.get("n.º da Amostra", "SEM_NUMERO")).strip() or "SEM_NUMERO"
 
     pdf = FPDF(unit="mm", format="A4")
     pdf.set_auto_page_break(auto=False)
@@ -705,65 +1187,46 @@ def generate_pdf(responses: Dict[str, Any]) -> bytes:
     y_start = pdf.get_y()
     x_qr  = pdf.l_margin
     x_bar = pdf.w - pdf.r_margin - bar_w
-    pdf.image(buf_qr, x=x_qr, y=y_start, w=qr_w)
-    pdf.image(buf_bar, x=x_bar, y=y_start + 5, w=bar_w)
+    _draw_qr(pdf, sample_no, x=x_qr, y=y_start, w=qr_w)
+    _draw_barcode(pdf, sample_no, x=x_bar, y=y_start + 5, w=bar_w, h=15)
     pdf.set_font("Helvetica", size=16)
     pdf.set_y(y_start + 8)
     pdf.set_x(0)
-    pdf.cell(w=0, h=10, txt="Oliveira Energia - Amostra de óleo", align="C", ln=True)
+    pdf.cell(w=0, h=10, text="Oliveira Energia - Amostra de óleo", align="C", new_x="LMARGIN", new_y="NEXT")
     pdf.ln(8)
 
-    # Corpo (duas perguntas por linha)
+    # Corpo (duas perguntas por linha) sobre a geometria pré-calculada
+    x0 = pdf.l_margin
     inner_width = pdf.w - pdf.l_margin - pdf.r_margin
-    LABEL_RATIO = 0.655
-    group_width = inner_width / 2
-    label_w  = group_width * LABEL_RATIO
-    value_w  = group_width - label_w
-    row_h    = 4.5
-
-    pdf.set_font("Helvetica", size=7)
+    y0 = pdf.get_y()
+    line = pdf.line
+    text = pdf.text
 
-    for section, qs in FORM_SECTIONS:
+    pdf.set_fill_color(240)
+    for title, y_title, y_top, grid_h, lines, labels, values in _pdf_body_layout(x0, inner_width):
         pdf.set_font("Helvetica", style="B", size=11)
-        pdf.set_fill_color(240)
-        pdf.cell(0, 7, _safe(section), ln=True, border=1, fill=True)
+        pdf.set_xy(x0, y0 + y_title)
+        pdf.cell(0, _PDF_SECTION_H, title, border=1, fill=True)
         pdf.set_font("Helvetica", size=9)
-
-        pairs = []
-        for label, _ in qs:
-            val = responses.get(label, "")
-            if val is True:
-                val = "Sim"
-            elif val is False:
-                val = "Não"
-            pairs.append((_safe(label), _safe(str(val))))
-
-        n_rows = ceil(len(pairs) / 2)
-        idx = 0
-        for _ in range(n_rows):
-            # esquerda
-            if idx < len(pairs):
-                lab, val = pairs[idx]
-                pdf.cell(label_w, row_h, lab, border=1)
-                pdf.cell(value_w, row_h, val, border=1)
-                idx += 1
-            else:
-                pdf.cell(label_w, row_h, "", border=1)
-                pdf.cell(value_w, row_h, "", border=1)
-            # direita
-            if idx < len(pairs):
-                lab, val = pairs[idx]
-                pdf.cell(label_w, row_h, lab, border=1)
-                pdf.cell(value_w, row_h, val, border=1)
-                idx += 1
-            else:
-                pdf.cell(label_w, row_h, "", border=1)
-                pdf.cell(value_w, row_h, "", border=1)
-            pdf.ln(row_h)
-        pdf.ln(1)
-
-    raw = pdf.output(dest="S")
-    return bytes(raw) if isinstance(raw, (bytes, bytearray)) else str(raw).encode("latin-1")
+        # Linha de base equivalente à de cell(): meio da linha + 0,3 × corpo da fonte
+        dx = pdf.c_margin
+        dy = y0 + _PDF_ROW_H / 2 + 0.3 * pdf.font_size
+
+        # Grade desenhada de uma vez; o texto vai direto com text(), sem o
+        # posicionamento/medição que cell() faz a cada chamada
+        pdf.rect(x0, y0 + y_top, inner_width, grid_h)
+        for x1, y1, x2, y2 in lines:
+            line(x1, y0 + y1, x2, y0 + y2)
+        # Cada label seguido do seu valor: a ordem do texto no PDF (copiar/buscar)
+        # mantém os pares juntos
+        for (x, y, label_text), (vx, vy, form_label) in zip(labels, values):
+            text(x + dx, y + dy, label_text)
+            value = _safe(_fmt(responses.get(form_label, "")))
+            if value:
+                text(vx + dx, vy + dy, value)
+
+    # fpdf2 devolve o documento já como bytearray (sem str intermediária)
+    return bytes(pdf.output())
 
 if __name__ == "__main__":
     if st is None: